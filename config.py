@@ -4,7 +4,12 @@ Configuration file for Telegram to FCM Bridge
 """
 
 import os
-import re
+
+try:
+    import re2 as re  # google-re2: linear-time matching when available
+except ImportError:
+    import re
+
 from datetime import timedelta, timezone
 
 # ============================================================================
@@ -15,6 +20,10 @@ TELEGRAM_API_ID = int(os.getenv('TELEGRAM_API_ID', '29831238'))
 TELEGRAM_API_HASH = os.getenv('TELEGRAM_API_HASH', '11211a9254f6d1a13f178047bc6ea29a')
 TELEGRAM_SESSION = "stc_autotrade_session"
 TELEGRAM_CHANNEL_ID = int(os.getenv('TELEGRAM_CHANNEL_ID', '-1003193908746'))
+SUMMARY_PRINT_INTERVAL = 100  # Print running statistics every N signals
+SIGNAL_FLUSH_INTERVAL_SECONDS = 0.1  # Buffered signals are sent this often
+SIGNAL_QUEUE_SIZE = 1000  # Max signals waiting for a sender worker
+SENDER_WORKERS = 4  # Concurrent signal sends
 
 # ============================================================================
 # FIREBASE CONFIGURATION
@@ -22,6 +31,11 @@ TELEGRAM_CHANNEL_ID = int(os.getenv('TELEGRAM_CHANNEL_ID', '-1003193908746'))
 
 FIREBASE_CREDENTIALS_JSON = os.getenv('FIREBASE_CREDENTIALS_JSON')
 FIREBASE_CREDENTIALS_FILE = "service-account.json"
+FIRESTORE_BATCH_LIMIT = 500  # Max writes per Firestore WriteBatch commit
+FIRESTORE_IN_QUERY_LIMIT = 30  # Max values in a Firestore 'in' filter
+FCM_TOKEN_CACHE_TTL_SECONDS = 60  # How long fetched token lists are reused
+FIRESTORE_FETCH_TIMEOUT_SECONDS = 5.0  # Deadline for token fetch queries
+FIRESTORE_PAGE_SIZE = 1000  # Documents per query page in full-collection scans
 
 # ============================================================================
 # TIMEZONE CONFIGURATION
@@ -33,16 +47,11 @@ WIB_TZ = timezone(timedelta(hours=7))
 # SIGNAL PATTERNS
 # ============================================================================
 
+# Compiled once at import; case-insensitivity is inline ((?i)) so the same
+# pattern strings work with both `re` and `re2`
 SIGNAL_PATTERNS = {
-    "time_with_trend": re.compile(
-        r'(\d{1,2})[:\.]\s*(\d{2})\s+([SB])', 
-        re.IGNORECASE
-    ),
-    "time_with_trend_strict": re.compile(
-        r'(\d{1,2})[:\.](\d{2})\s+([SB])', 
-        re.IGNORECASE
-    ),
-    "simple_trend": re.compile(r'^([SB])$', re.IGNORECASE)
+    # Both alternatives in one pass: groups 1-3 for a timed signal, 4 for a bare trend
+    "combined": re.compile(r'(?i)(\d{1,2})[:\.]\s*(\d{2})\s+([SB])|^([SB])$')
 }
 
 # ============================================================================
@@ -50,4 +59,5 @@ SIGNAL_PATTERNS = {
 # ============================================================================
 
 FCM_TTL_SECONDS = 60
-FCM_CHANNEL_ID = "trading_signals"
\ No newline at end of file
+FCM_CHANNEL_ID = "trading_signals"
+FCM_MULTICAST_LIMIT = 500  # Max tokens per send_each_for_multicast call
\ No newline at end of file
@@ -3,31 +3,66 @@
 FCM message sender
 """
 
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import sys
+import time
+import traceback
+from datetime import timedelta
+from functools import lru_cache
 from firebase_admin import messaging
-from config import FCM_TTL_SECONDS, FCM_CHANNEL_ID
-from statistics import stats
+from config import FCM_TTL_SECONDS, FCM_CHANNEL_ID, FCM_MULTICAST_LIMIT
+from statistics import stats, StatsShard
+from firebase_manager import firebase_manager, TokenBatch
+from utils import SEP_EQ
 
+log = logging.getLogger(__name__)
 
-def send_signal_to_tokens(signal_data: dict, tokens: list) -> dict:
+# Shared across every send; only the notification body varies per signal
+_FCM_TTL = timedelta(seconds=FCM_TTL_SECONDS)
+
+# Interned payload constants (FCM data values must be strings)
+_TRUE = sys.intern("true")
+_FALSE = sys.intern("false")
+_BOOL_STR = {True: _TRUE, False: _FALSE}
+_TYPE = sys.intern("TRADING_SIGNAL")
+_TREND_WORDS = {sys.intern("call"): sys.intern("BUY"), sys.intern("put"): sys.intern("SELL")}
+
+
+@lru_cache(maxsize=256)
+def _android_config(body: str) -> messaging.AndroidConfig:
+    """AndroidConfig for a notification body, built once per distinct body"""
+    return messaging.AndroidConfig(
+        priority='high',
+        ttl=_FCM_TTL,
+        notification=messaging.AndroidNotification(
+            title="🎯 New Trading Signal",
+            body=body,
+            sound="default",
+            priority="high",
+            channel_id=FCM_CHANNEL_ID
+        )
+    )
+
+
+def send_signal_to_tokens(signal_data: dict, tokens: TokenBatch) -> dict:
     """
     Send trading signal to specified FCM tokens
     
     Args:
         signal_data: Signal data dict
-        tokens: List of tuples [(identifier, fcmToken, type), ...]
+        tokens: TokenBatch of (identifier, fcmToken, type)
     
     Returns:
         dict with success/failure counts
     """
+    # Sender workers run concurrently, so each send's output is collected
+    # here and logged as one record instead of interleaving line by line
+    log_lines = [SEP_EQ, f"🚀 SENDING FCM TO {len(tokens)} TOKENS", SEP_EQ]
     try:
-        print("=" * 60)
-        print(f"🚀 SENDING FCM TO {len(tokens)} TOKENS")
-        print("=" * 60)
-        
         # Validate signal data
         if not signal_data.get('has_time'):
-            print("❌ ERROR: Signal has no time!")
+            log_lines.append("❌ ERROR: Signal has no time!")
             return {"success": 0, "failed": 0, "total": 0, "user_success": 0, "admin_success": 0}
             
         hour = signal_data.get('hour')
@@ -35,84 +70,105 @@ def send_signal_to_tokens(signal_data: dict, tokens: list) -> dict:
         second = signal_data.get('second', 0)  # Default 0 jika tidak ada
         
         if hour is None or minute is None or not isinstance(hour, int) or not isinstance(minute, int):
-            print(f"❌ ERROR: Invalid hour/minute!")
+            log_lines.append("❌ ERROR: Invalid hour/minute!")
             return {"success": 0, "failed": 0, "total": 0, "user_success": 0, "admin_success": 0}
         
         if not tokens:
-            print("⚠️  No FCM tokens provided")
+            log_lines.append("⚠️  No FCM tokens provided")
             return {"success": 0, "failed": 0, "total": 0, "user_success": 0, "admin_success": 0}
         
-        print(f"📡 Sending to {len(tokens)} devices...")
+        log_lines.append(f"📡 Sending to {len(tokens)} devices...")
         
         # ✅ PERBAIKAN: Gunakan kata lengkap (BUY/SELL) bukan huruf (B/S)
-        trend_word = "BUY" if signal_data['trend'] == "call" else "SELL"
+        trend_word = _TREND_WORDS.get(signal_data['trend'], "SELL")
         formatted_message = f"{hour:02d}:{minute:02d}:{second:02d} {trend_word}"
         
         fcm_data = {
-            "type": "TRADING_SIGNAL",
+            "type": _TYPE,
             "trend": signal_data["trend"],
-            "has_time": "true",
+            "has_time": _TRUE,
             "hour": str(hour),
             "minute": str(minute),
             "second": str(second),
             "original_message": formatted_message,
             "formatted_message": formatted_message,
-            "auto_time_added": str(signal_data.get("auto_time_added", False)).lower(),
+            "auto_time_added": _BOOL_STR[bool(signal_data.get("auto_time_added"))],
             "parsed_at": signal_data["parsed_at"],
-            "timestamp": str(int(datetime.now().timestamp() * 1000))
+            "timestamp": str(time.time_ns() // 1_000_000)
         }
         
-        # Send to each token
+        android_config = _android_config(formatted_message)
+        
+        # Send in multicast batches (FCM accepts up to 500 tokens per call)
         success_count = 0
         failed_count = 0
         user_success = 0
         admin_success = 0
+        dead_tokens = []
+        shard = StatsShard()
+        
+        batches = [
+            tokens[start:start + FCM_MULTICAST_LIMIT]
+            for start in range(0, len(tokens), FCM_MULTICAST_LIMIT)
+        ]
         
-        for identifier, token, user_type in tokens:
+        # Batches go out one after another: send_each_for_multicast already
+        # fans out over its own thread pool, and concurrency across signals
+        # is capped by the sender workers
+        for batch in batches:
             try:
-                message = messaging.Message(
-                    data=fcm_data,
-                    token=token,
-                    android=messaging.AndroidConfig(
-                        priority='high',
-                        ttl=timedelta(seconds=FCM_TTL_SECONDS),
-                        notification=messaging.AndroidNotification(
-                            title="🎯 New Trading Signal",
-                            body=formatted_message,
-                            sound="default",
-                            priority="high",
-                            channel_id=FCM_CHANNEL_ID
-                        )
+                batch_response = messaging.send_each_for_multicast(
+                    messaging.MulticastMessage(
+                        data=fcm_data,
+                        tokens=batch.tokens,
+                        android=android_config
                     )
                 )
-                
-                response = messaging.send(message)
-                success_count += 1
-                
-                if "admin" in user_type.lower():
-                    admin_success += 1
-                else:
-                    user_success += 1
-                
-                print(f"   ✅ Sent to {identifier} ({user_type}): {response}")
-                stats.log_signal(signal_data["trend"], True, identifier, user_type)
-                
-            except messaging.UnregisteredError:
-                failed_count += 1
-                print(f"   ❌ Invalid token for {identifier} ({user_type})")
-                stats.log_signal(signal_data["trend"], False, identifier, user_type)
             except Exception as e:
-                failed_count += 1
-                print(f"   ❌ Failed to send to {identifier} ({user_type}): {e}")
-                stats.log_signal(signal_data["trend"], False, identifier, user_type)
+                for identifier, user_type in zip(batch.identifiers, batch.types):
+                    failed_count += 1
+                    log_lines.append(f"   ❌ Failed to send to {identifier} ({user_type}): {e}")
+                    shard.log_signal(signal_data["trend"], False, identifier, user_type)
+                continue
+            
+            for identifier, token, user_type, response in zip(batch.identifiers, batch.tokens, batch.types, batch_response.responses):
+                if response.success:
+                    success_count += 1
+                    
+                    if user_type.startswith("admin"):
+                        admin_success += 1
+                    else:
+                        user_success += 1
+                    
+                    log_lines.append(f"   ✅ Sent to {identifier} ({user_type}): {response.message_id}")
+                    shard.log_signal(signal_data["trend"], True, identifier, user_type)
+                    
+                elif isinstance(response.exception, messaging.UnregisteredError):
+                    failed_count += 1
+                    dead_tokens.append((token, user_type))
+                    log_lines.append(f"   ❌ Invalid token for {identifier} ({user_type})")
+                    shard.log_signal(signal_data["trend"], False, identifier, user_type)
+                else:
+                    failed_count += 1
+                    log_lines.append(f"   ❌ Failed to send to {identifier} ({user_type}): {response.exception}")
+                    shard.log_signal(signal_data["trend"], False, identifier, user_type)
+        
+        # One locked merge per send instead of shared updates per device
+        stats.merge(shard)
+        
+        if dead_tokens:
+            # Clear dead tokens so future queries (fcmToken != '') skip them
+            firebase_manager.mark_dead_tokens(dead_tokens)
         
-        print(f"\n📊 Send Summary:")
-        print(f"   Total: {len(tokens)}")
-        print(f"   Success: {success_count}")
-        print(f"   - Users: {user_success}")
-        print(f"   - Admins: {admin_success}")
-        print(f"   Failed: {failed_count}")
-        print("=" * 60)
+        log_lines.extend((
+            "\n📊 Send Summary:",
+            f"   Total: {len(tokens)}",
+            f"   Success: {success_count}",
+            f"   - Users: {user_success}",
+            f"   - Admins: {admin_success}",
+            f"   Failed: {failed_count}",
+            SEP_EQ
+        ))
         
         return {
             "success": success_count,
@@ -123,7 +179,19 @@ def send_signal_to_tokens(signal_data: dict, tokens: list) -> dict:
         }
         
     except Exception as e:
-        print(f"❌ Error in send_signal_to_tokens: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"success": 0, "failed": 0, "total": 0, "user_success": 0, "admin_success": 0}
\ No newline at end of file
+        log_lines.append(f"❌ Error in send_signal_to_tokens: {e}")
+        log_lines.append(traceback.format_exc().rstrip())
+        return {"success": 0, "failed": 0, "total": 0, "user_success": 0, "admin_success": 0}
+    
+    finally:
+        log.info("\n".join(log_lines))
+
+
+async def send_signal_to_tokens_async(signal_data: dict, tokens: TokenBatch) -> dict:
+    """
+    Non-blocking wrapper for send_signal_to_tokens
+    
+    Runs the blocking Firebase Admin calls on a worker thread so the
+    Telegram event loop keeps processing updates during the send.
+    """
+    return await asyncio.to_thread(send_signal_to_tokens, signal_data, tokens)
\ No newline at end of file
@@ -3,23 +3,102 @@
 Firebase and Firestore management
 """
 
-import json
+try:
+    import orjson as json  # orjson: C-accelerated loads() when available
+except ImportError:
+    import json
+
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 import firebase_admin
 from firebase_admin import credentials, firestore
-from config import FIREBASE_CREDENTIALS_JSON, FIREBASE_CREDENTIALS_FILE
+from google.api_core import exceptions as api_exceptions
+from google.api_core import retry as retries
+from google.cloud.firestore_v1.base_query import FieldFilter
+from config import (
+    FIREBASE_CREDENTIALS_JSON,
+    FIREBASE_CREDENTIALS_FILE,
+    FIRESTORE_BATCH_LIMIT,
+    FIRESTORE_IN_QUERY_LIMIT,
+    FCM_TOKEN_CACHE_TTL_SECONDS,
+    FIRESTORE_FETCH_TIMEOUT_SECONDS,
+    FIRESTORE_PAGE_SIZE
+)
+
+log = logging.getLogger(__name__)
+
+# Token fetches fail fast so a Firestore hiccup doesn't stall signal fanout
+_FETCH_RETRY = retries.Retry(initial=0.1, maximum=1.0, deadline=FIRESTORE_FETCH_TIMEOUT_SECONDS)
+_FETCH_TIMEOUT_ERRORS = (api_exceptions.DeadlineExceeded, api_exceptions.RetryError)
+
+
+@lru_cache(maxsize=16)
+def _admin_tag(role):
+    """Shared type tag for admins, e.g. 'admin (super_admin)'"""
+    return f'admin ({role})'
+
+
+@dataclass
+class TokenBatch:
+    """
+    FCM tokens stored as parallel lists (struct of arrays)
+    
+    Iterating yields (identifier, fcmToken, type) tuples, slicing
+    returns a new TokenBatch.
+    """
+    identifiers: list = field(default_factory=list)
+    tokens: list = field(default_factory=list)
+    types: list = field(default_factory=list)
+    
+    def __len__(self):
+        return len(self.tokens)
+    
+    def __iter__(self):
+        return zip(self.identifiers, self.tokens, self.types)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TokenBatch(self.identifiers[index], self.tokens[index], self.types[index])
+        return self.identifiers[index], self.tokens[index], self.types[index]
+    
+    def append(self, identifier, token, user_type):
+        self.identifiers.append(identifier)
+        self.tokens.append(token)
+        self.types.append(user_type)
+    
+    def extend(self, other):
+        self.identifiers.extend(other.identifiers)
+        self.tokens.extend(other.tokens)
+        self.types.extend(other.types)
 
 
 class FirebaseManager:
     def __init__(self):
         self.db = None
+        self.users_ref = None
+        self.admins_ref = None
+        # cache_key -> (TokenBatch, monotonic expiry); one entry per read so a
+        # concurrent invalidate_token_cache() can't split tokens from expiry
+        self._token_cache = {}
+        self._token_index_missing = False
+    
+    def _set_client(self):
+        """Create the Firestore client and cache collection references"""
+        self.db = firestore.client()
+        self.users_ref = self.db.collection('whitelist_users')
+        self.admins_ref = self.db.collection('admin_users')
     
     def initialize(self):
         """Initialize Firebase Admin SDK with Firestore"""
         try:
             if firebase_admin._apps:
                 print("✅ Firebase already initialized")
-                self.db = firestore.client()
+                self._set_client()
                 return True
                 
             if FIREBASE_CREDENTIALS_JSON:
@@ -35,7 +114,7 @@ class FirebaseManager:
                 cred = credentials.Certificate(str(cred_path))
                 
             firebase_admin.initialize_app(cred)
-            self.db = firestore.client()
+            self._set_client()
             
             print("✅ Firebase initialized successfully")
             print("✅ Firestore client ready")
@@ -45,78 +124,121 @@ class FirebaseManager:
             print(f"❌ Firebase initialization error: {e}")
             return False
     
-    def get_all_active_user_fcm_tokens(self) -> list:
+    def _stream_active_tokens(self, collection_ref, fields, log_lines) -> list:
+        """
+        Fetch active documents with a non-empty fcmToken
+        
+        The fcmToken != '' filter needs a composite index (isActive +
+        fcmToken). Without it Firestore raises FailedPrecondition, so the
+        query is retried with isActive only; callers already drop empty
+        tokens client-side.
+        
+        Args:
+            collection_ref: whitelist_users or admin_users reference
+            fields: Fields to project
+            log_lines: Output lines of the calling fetch
+        
+        Returns:
+            list of DocumentSnapshot
+        """
+        active = collection_ref.where(filter=FieldFilter('isActive', '==', True))
+        if not self._token_index_missing:
+            try:
+                return list(active.where(
+                    filter=FieldFilter('fcmToken', '!=', '')
+                ).select(fields).stream(
+                    retry=_FETCH_RETRY, timeout=FIRESTORE_FETCH_TIMEOUT_SECONDS
+                ))
+            except api_exceptions.FailedPrecondition as e:
+                # Remember the missing index so later fetches skip the failing query
+                self._token_index_missing = True
+                log_lines.append(f"⚠️  Composite index (isActive + fcmToken) missing, filtering tokens client-side: {e}")
+        
+        return list(active.select(fields).stream(
+            retry=_FETCH_RETRY, timeout=FIRESTORE_FETCH_TIMEOUT_SECONDS
+        ))
+    
+    def get_all_active_user_fcm_tokens(self, log_lines=None) -> TokenBatch:
         """
         Get all active FCM tokens from whitelist_users collection
         
+        Args:
+            log_lines: Optional list to collect output in; logged here when omitted
+        
         Returns:
-            list of tuples: [(userId, fcmToken, email), ...]
+            TokenBatch with identifiers=email, types='user'
         """
+        own_output = log_lines is None
+        if own_output:
+            log_lines = []
+        
         try:
             if self.db is None:
-                print("❌ Firestore client not initialized")
-                return []
-            
-            print("🔍 Fetching active user FCM tokens from Firestore...")
+                log_lines.append("❌ Firestore client not initialized")
+                return TokenBatch()
             
-            from google.cloud.firestore_v1.base_query import FieldFilter
+            log_lines.append("🔍 Fetching active user FCM tokens from Firestore...")
             
-            users_ref = self.db.collection('whitelist_users')
-            query = users_ref.where(
-                filter=FieldFilter('isActive', '==', True)
-            ).stream()
+            query = self._stream_active_tokens(self.users_ref, ['fcmToken', 'email'], log_lines)
             
-            tokens = []
+            tokens = TokenBatch()
             processed_count = 0
             
             for doc in query:
                 processed_count += 1
                 user_data = doc.to_dict()
-                user_id = user_data.get('userId', '')
                 fcm_token = user_data.get('fcmToken', '')
                 email = user_data.get('email', '')
                 
+                # Whitespace-only tokens pass the server-side filter, and empty ones
+                # reach here when the index fallback is used
                 if fcm_token and fcm_token.strip():
-                    tokens.append((user_id, fcm_token, email))
-                    print(f"   ✅ {email}: Token {fcm_token[:20]}...{fcm_token[-20:]}")
+                    tokens.append(email, fcm_token, 'user')
+                    log_lines.append(f"   ✅ {email}: Token {fcm_token[:20]}...{fcm_token[-20:]}")
                 else:
-                    print(f"   ⚠️  {email}: No FCM token (skipped)")
+                    log_lines.append(f"   ⚠️  {email}: No FCM token (skipped)")
             
-            print(f"📊 Processed {processed_count} active users")
-            print(f"📊 Found {len(tokens)} users with valid FCM tokens")
+            log_lines.append(f"📊 Processed {processed_count} active users")
+            log_lines.append(f"📊 Found {len(tokens)} users with valid FCM tokens")
             return tokens
             
+        except _FETCH_TIMEOUT_ERRORS:
+            raise  # Let get_all_fcm_tokens_combined fall back to cached tokens
+            
         except Exception as e:
-            print(f"❌ Error fetching user FCM tokens: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            log_lines.append(f"❌ Error fetching user FCM tokens: {e}")
+            log_lines.append(traceback.format_exc().rstrip())
+            return TokenBatch()
+        
+        finally:
+            if own_output:
+                log.info("\n".join(log_lines))
     
-    def get_all_admin_fcm_tokens(self, role_filter=None) -> list:
+    def get_all_admin_fcm_tokens(self, role_filter=None, log_lines=None) -> TokenBatch:
         """
         Get all active admin FCM tokens from admin_users collection
         
         Args:
             role_filter: Optional role filter ('admin', 'super_admin', etc.)
+            log_lines: Optional list to collect output in; logged here when omitted
         
         Returns:
-            list of tuples: [(email, fcmToken, role), ...]
+            TokenBatch with identifiers=email, types='admin (<role>)'
         """
+        own_output = log_lines is None
+        if own_output:
+            log_lines = []
+        
         try:
             if self.db is None:
-                print("❌ Firestore client not initialized")
-                return []
+                log_lines.append("❌ Firestore client not initialized")
+                return TokenBatch()
             
-            print("🔍 Fetching admin FCM tokens from Firestore...")
+            log_lines.append("🔍 Fetching admin FCM tokens from Firestore...")
             
-            from google.cloud.firestore_v1.base_query import FieldFilter
+            query = self._stream_active_tokens(self.admins_ref, ['email', 'fcmToken', 'role'], log_lines)
             
-            admins_ref = self.db.collection('admin_users')
-            query = admins_ref.where(
-                filter=FieldFilter('isActive', '==', True)
-            ).stream()
-            
-            tokens = []
+            tokens = TokenBatch()
             processed_count = 0
             
             for doc in query:
@@ -130,23 +252,31 @@ class FirebaseManager:
                 if role_filter and role != role_filter:
                     continue
                 
+                # Whitespace-only tokens pass the server-side filter, and empty ones
+                # reach here when the index fallback is used
                 if fcm_token and fcm_token.strip():
-                    tokens.append((email, fcm_token, role))
-                    print(f"   ✅ {email} ({role}): Token {fcm_token[:20]}...{fcm_token[-20:]}")
+                    tokens.append(email, fcm_token, _admin_tag(role))
+                    log_lines.append(f"   ✅ {email} ({role}): Token {fcm_token[:20]}...{fcm_token[-20:]}")
                 else:
-                    print(f"   ⚠️  {email} ({role}): No FCM token (skipped)")
+                    log_lines.append(f"   ⚠️  {email} ({role}): No FCM token (skipped)")
             
-            print(f"📊 Processed {processed_count} active admins")
-            print(f"📊 Found {len(tokens)} admins with valid FCM tokens")
+            log_lines.append(f"📊 Processed {processed_count} active admins")
+            log_lines.append(f"📊 Found {len(tokens)} admins with valid FCM tokens")
             return tokens
             
+        except _FETCH_TIMEOUT_ERRORS:
+            raise  # Let get_all_fcm_tokens_combined fall back to cached tokens
+            
         except Exception as e:
-            print(f"❌ Error fetching admin FCM tokens: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            log_lines.append(f"❌ Error fetching admin FCM tokens: {e}")
+            log_lines.append(traceback.format_exc().rstrip())
+            return TokenBatch()
+        
+        finally:
+            if own_output:
+                log.info("\n".join(log_lines))
     
-    def get_all_fcm_tokens_combined(self, user_only=False, admin_only=False, admin_role_filter=None) -> list:
+    def get_all_fcm_tokens_combined(self, user_only=False, admin_only=False, admin_role_filter=None) -> TokenBatch:
         """
         Get FCM tokens from whitelist users and/or admins
         
@@ -156,48 +286,204 @@ class FirebaseManager:
             admin_role_filter: Filter admins by role
         
         Returns:
-            list of tuples: [(identifier, fcmToken, type), ...]
+            TokenBatch iterating as (identifier, fcmToken, type)
         """
+        cache_key = (user_only, admin_only, admin_role_filter)
+        cached_tokens, expiry = self._token_cache.get(cache_key, (None, 0))
+        if time.monotonic() < expiry:
+            log.info("⚡ Using cached FCM tokens (%d devices)", len(cached_tokens))
+            return cached_tokens
+        
+        # The getters append to these lists instead of printing, so the
+        # concurrent user/admin fetches come out as one block once both finish
+        log_lines = ["=" * 60]
         try:
-            print("=" * 60)
-            
             if user_only:
-                print("🔍 FETCHING USER FCM TOKENS ONLY")
+                log_lines.append("🔍 FETCHING USER FCM TOKENS ONLY")
             elif admin_only:
-                print("🔍 FETCHING ADMIN FCM TOKENS ONLY")
+                log_lines.append("🔍 FETCHING ADMIN FCM TOKENS ONLY")
             else:
-                print("🔍 FETCHING ALL FCM TOKENS (USERS + ADMINS)")
+                log_lines.append("🔍 FETCHING ALL FCM TOKENS (USERS + ADMINS)")
             
-            print("=" * 60)
+            log_lines.append("=" * 60)
             
-            all_tokens = []
+            all_tokens = TokenBatch()
+            
+            if not user_only and not admin_only:
+                # Fetch both collections concurrently (Firestore client is thread-safe)
+                log_lines.append("\n📱👑 Fetching whitelist users and admins...")
+                user_lines = []
+                admin_lines = []
+                try:
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        user_future = executor.submit(self.get_all_active_user_fcm_tokens, log_lines=user_lines)
+                        admin_future = executor.submit(self.get_all_admin_fcm_tokens, role_filter=admin_role_filter, log_lines=admin_lines)
+                        user_tokens = user_future.result()
+                        admin_tokens = admin_future.result()
+                finally:
+                    log_lines.extend(user_lines)
+                    log_lines.extend(admin_lines)
+            else:
+                user_tokens = TokenBatch()
+                admin_tokens = TokenBatch()
+                
+                if not admin_only:
+                    log_lines.append("\n📱 Fetching whitelist users...")
+                    user_tokens = self.get_all_active_user_fcm_tokens(log_lines=log_lines)
+                
+                if not user_only:
+                    log_lines.append("\n👑 Fetching admins...")
+                    admin_tokens = self.get_all_admin_fcm_tokens(role_filter=admin_role_filter, log_lines=log_lines)
             
             # Get users
             if not admin_only:
-                print("\n📱 Fetching whitelist users...")
-                user_tokens = self.get_all_active_user_fcm_tokens()
-                for user_id, token, email in user_tokens:
-                    all_tokens.append((email, token, 'user'))
-                print(f"   Found {len(user_tokens)} users with tokens")
+                all_tokens.extend(user_tokens)
+                log_lines.append(f"   Found {len(user_tokens)} users with tokens")
             
             # Get admins
             if not user_only:
-                print("\n👑 Fetching admins...")
-                admin_tokens = self.get_all_admin_fcm_tokens(role_filter=admin_role_filter)
-                for email, token, role in admin_tokens:
-                    all_tokens.append((email, token, f'admin ({role})'))
-                print(f"   Found {len(admin_tokens)} admins with tokens")
+                all_tokens.extend(admin_tokens)
+                log_lines.append(f"   Found {len(admin_tokens)} admins with tokens")
+            
+            log_lines.append(f"\n📊 TOTAL: {len(all_tokens)} devices with FCM tokens")
+            log_lines.append("=" * 60)
             
-            print(f"\n📊 TOTAL: {len(all_tokens)} devices with FCM tokens")
-            print("=" * 60)
+            # Empty results are not cached so a failed fetch is retried next time
+            if all_tokens:
+                self._token_cache[cache_key] = (all_tokens, time.monotonic() + FCM_TOKEN_CACHE_TTL_SECONDS)
             
             return all_tokens
             
+        except _FETCH_TIMEOUT_ERRORS as e:
+            stale_tokens = self._token_cache.get(cache_key, (TokenBatch(), 0))[0]
+            log_lines.append(f"⚠️  Firestore timed out fetching tokens: {e}")
+            log_lines.append(f"⚡ Falling back to last cached FCM tokens ({len(stale_tokens)} devices)")
+            return stale_tokens
+            
+        except Exception as e:
+            log_lines.append(f"❌ Error fetching combined tokens: {e}")
+            log_lines.append(traceback.format_exc().rstrip())
+            return TokenBatch()
+        
+        finally:
+            log.info("\n".join(log_lines))
+    
+    def invalidate_token_cache(self):
+        """Drop cached token lists so the next fetch hits Firestore"""
+        self._token_cache.clear()
+    
+    def mark_dead_tokens(self, dead_tokens) -> int:
+        """
+        Clear FCM tokens that FCM reported as unregistered
+        
+        Args:
+            dead_tokens: list of tuples [(fcmToken, type), ...]
+        
+        Returns:
+            Number of documents cleared
+        """
+        try:
+            if self.db is None or not dead_tokens:
+                return 0
+            
+            # Split by collection, then look documents up FIRESTORE_IN_QUERY_LIMIT
+            # tokens per query instead of one query per token
+            admin_tokens = [t for t, user_type in dead_tokens if user_type.startswith('admin')]
+            user_tokens = [t for t, user_type in dead_tokens if not user_type.startswith('admin')]
+            
+            writes = []
+            for collection_ref, tokens in ((self.users_ref, user_tokens), (self.admins_ref, admin_tokens)):
+                for start in range(0, len(tokens), FIRESTORE_IN_QUERY_LIMIT):
+                    query = collection_ref.where(
+                        filter=FieldFilter('fcmToken', 'in', tokens[start:start + FIRESTORE_IN_QUERY_LIMIT])
+                    ).select([]).stream()
+                    
+                    for doc in query:
+                        writes.append((doc.reference, {'fcmToken': '', 'fcmTokenUpdatedAt': 0}))
+            
+            cleared_count = self.commit_in_batches(writes)
+            self.invalidate_token_cache()
+            
+            log.info("🧹 Cleared %d unregistered FCM tokens", cleared_count)
+            return cleared_count
+            
         except Exception as e:
-            print(f"❌ Error fetching combined tokens: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            log.exception("❌ Error clearing unregistered FCM tokens: %s", e)
+            return 0
+    
+    def stream_in_pages(self, query, page_size=FIRESTORE_PAGE_SIZE):
+        """
+        Iterate a query page by page with limit() + start_after() cursors
+        
+        The Python client exposes no page size on stream(), and a single
+        stream over a large collection can hit its RPC deadline part way
+        through. Paging keeps each RPC bounded to page_size documents.
+        
+        Args:
+            query: Firestore query or collection reference
+            page_size: Documents fetched per RPC
+        
+        Yields:
+            DocumentSnapshot
+        """
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+            
+            count = 0
+            for doc in page.stream():
+                count += 1
+                last_doc = doc
+                yield doc
+            
+            if count < page_size:
+                return
+    
+    def commit_in_batches(self, writes, merge=True) -> int:
+        """
+        Apply writes with WriteBatch, committing every FIRESTORE_BATCH_LIMIT ops
+        
+        Full batches are committed on a background thread while the next one
+        is built, so a lazily produced ``writes`` (e.g. a generator over a
+        document stream) overlaps reading with writing. At most one commit is
+        in flight at a time.
+        
+        Args:
+            writes: Iterable of (doc_ref, data) pairs
+            merge: Passed to batch.set()
+        
+        Returns:
+            Number of documents written
+        """
+        batch = self.db.batch()
+        pending = 0
+        written = 0
+        in_flight = None
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for doc_ref, data in writes:
+                batch.set(doc_ref, data, merge=merge)
+                pending += 1
+                
+                if pending == FIRESTORE_BATCH_LIMIT:
+                    if in_flight is not None:
+                        in_flight.result()
+                        written += FIRESTORE_BATCH_LIMIT
+                    in_flight = executor.submit(batch.commit)
+                    batch = self.db.batch()
+                    pending = 0
+            
+            if in_flight is not None:
+                in_flight.result()
+                written += FIRESTORE_BATCH_LIMIT
+        
+        if pending:
+            batch.commit()
+            written += pending
+        
+        return written
 
 
 # Global Firebase manager instance
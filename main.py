@@ -5,21 +5,12 @@ Main entry point for Telegram to FCM Bridge
 
 import os
 import asyncio
-from datetime import datetime
-from utils import get_current_time, print_header
+from utils import get_current_time, print_header, configure_logging
+from signal_parser import parsed_at_now
 from firebase_manager import firebase_manager
-from telegram_client import listen_telegram_signals
-from fcm_sender import send_signal_to_tokens
-from migrations import (
-    migrate_add_fcm_field_all,
-    migrate_add_fcm_field_to_users,
-    migrate_add_fcm_field_to_admins,
-    check_fcm_token_status,
-    reset_fcm_token_for_users,
-    reset_fcm_token_for_admins,
-    reset_fcm_token_all,
-    custom_migration
-)
+
+# telegram_client, fcm_sender and migrations are imported lazily inside the
+# menu paths that use them to keep startup light
 
 
 def test_view_all_tokens():
@@ -32,8 +23,8 @@ def test_view_all_tokens():
     print(f"   Total tokens: {len(tokens)}")
     
     if tokens:
-        user_count = sum(1 for _, _, t in tokens if t == 'user')
-        admin_count = sum(1 for _, _, t in tokens if 'admin' in t.lower())
+        user_count = tokens.types.count('user')
+        admin_count = len(tokens) - user_count
         
         print(f"   Users: {user_count}")
         print(f"   Admins: {admin_count}")
@@ -56,6 +47,8 @@ def test_send_to_users():
     """Test sending signal to users only"""
     print_header("🧪 TESTING SEND TO USERS ONLY")
     
+    from fcm_sender import send_signal_to_tokens
+    
     now_utc, now_wib = get_current_time()
     
     test_signal = {
@@ -65,7 +58,7 @@ def test_send_to_users():
         "minute": (now_wib.minute + 1) % 60,
         "original_message": f"TEST USER: {now_wib.hour:02d}:{(now_wib.minute + 1) % 60:02d} B",
         "auto_time_added": False,
-        "parsed_at": datetime.now().isoformat()
+        "parsed_at": parsed_at_now()
     }
     
     tokens = firebase_manager.get_all_fcm_tokens_combined(user_only=True)
@@ -82,6 +75,8 @@ def test_send_to_admins():
     """Test sending signal to admins only"""
     print_header("🧪 TESTING SEND TO ADMINS ONLY")
     
+    from fcm_sender import send_signal_to_tokens
+    
     now_utc, now_wib = get_current_time()
     
     test_signal = {
@@ -91,7 +86,7 @@ def test_send_to_admins():
         "minute": (now_wib.minute + 1) % 60,
         "original_message": f"TEST ADMIN: {now_wib.hour:02d}:{(now_wib.minute + 1) % 60:02d} S",
         "auto_time_added": False,
-        "parsed_at": datetime.now().isoformat()
+        "parsed_at": parsed_at_now()
     }
     
     tokens = firebase_manager.get_all_fcm_tokens_combined(admin_only=True)
@@ -108,6 +103,8 @@ def test_send_to_super_admin():
     """Test sending signal to super admin only"""
     print_header("🧪 TESTING SEND TO SUPER ADMIN ONLY")
     
+    from fcm_sender import send_signal_to_tokens
+    
     now_utc, now_wib = get_current_time()
     
     test_signal = {
@@ -117,7 +114,7 @@ def test_send_to_super_admin():
         "minute": (now_wib.minute + 1) % 60,
         "original_message": f"TEST SUPER ADMIN: {now_wib.hour:02d}:{(now_wib.minute + 1) % 60:02d} B",
         "auto_time_added": False,
-        "parsed_at": datetime.now().isoformat()
+        "parsed_at": parsed_at_now()
     }
     
     tokens = firebase_manager.get_all_fcm_tokens_combined(admin_only=True, admin_role_filter='super_admin')
@@ -134,6 +131,8 @@ def test_send_to_all():
     """Test sending signal to all (users + admins)"""
     print_header("🧪 TESTING SEND TO ALL (USERS + ADMINS)")
     
+    from fcm_sender import send_signal_to_tokens
+    
     now_utc, now_wib = get_current_time()
     
     test_signal = {
@@ -143,7 +142,7 @@ def test_send_to_all():
         "minute": (now_wib.minute + 1) % 60,
         "original_message": f"TEST ALL: {now_wib.hour:02d}:{(now_wib.minute + 1) % 60:02d} B",
         "auto_time_added": False,
-        "parsed_at": datetime.now().isoformat()
+        "parsed_at": parsed_at_now()
     }
     
     tokens = firebase_manager.get_all_fcm_tokens_combined()
@@ -199,6 +198,9 @@ def show_menu():
 def main():
     """Main entry point"""
     
+    # Module loggers print to stdout like the rest of the menu
+    configure_logging()
+    
     # Initialize Firebase
     if not firebase_manager.initialize():
         print("\n❌ Cannot proceed without Firebase")
@@ -208,6 +210,7 @@ def main():
     if os.getenv('RENDER'):
         print("\n🔧 Detected Render environment - Starting production mode")
         print("📡 Mode: All Users + All Admins\n")
+        from telegram_client import listen_telegram_signals
         asyncio.run(listen_telegram_signals())
         return
     
@@ -219,18 +222,22 @@ def main():
         
         if choice == "1":
             # Production: All Users + All Admins
+            from telegram_client import listen_telegram_signals
             asyncio.run(listen_telegram_signals())
             
         elif choice == "2":
             # Test: Admins Only
+            from telegram_client import listen_telegram_signals
             asyncio.run(listen_telegram_signals(admin_only=True))
             
         elif choice == "3":
             # Test: Super Admin Only
+            from telegram_client import listen_telegram_signals
             asyncio.run(listen_telegram_signals(admin_only=True, admin_role_filter='super_admin'))
             
         elif choice == "4":
             # Test: Users Only
+            from telegram_client import listen_telegram_signals
             asyncio.run(listen_telegram_signals(user_only=True))
             
         elif choice == "5":
@@ -260,6 +267,7 @@ def main():
             
         elif choice == "10":
             # Check FCM Token Status
+            from migrations import check_fcm_token_status
             check_fcm_token_status()
             input("\nPress Enter to continue...")
             
@@ -269,6 +277,7 @@ def main():
             print("This will add 'fcmToken' and 'fcmTokenUpdatedAt' fields to users and admins.")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import migrate_add_fcm_field_all
                 migrate_add_fcm_field_all()
             else:
                 print("❌ Migration cancelled")
@@ -280,6 +289,7 @@ def main():
             print("This will add 'fcmToken' and 'fcmTokenUpdatedAt' fields to users.")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import migrate_add_fcm_field_to_users
                 migrate_add_fcm_field_to_users()
             else:
                 print("❌ Migration cancelled")
@@ -291,6 +301,7 @@ def main():
             print("This will add 'fcmToken' and 'fcmTokenUpdatedAt' fields to admins.")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import migrate_add_fcm_field_to_admins
                 migrate_add_fcm_field_to_admins()
             else:
                 print("❌ Migration cancelled")
@@ -301,6 +312,7 @@ def main():
             print("⚠️  WARNING: This will reset FCM token for a specific user!")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import reset_fcm_token_for_users
                 reset_fcm_token_for_users(reset_all=False)
             else:
                 print("❌ Reset cancelled")
@@ -311,6 +323,7 @@ def main():
             print("⚠️  WARNING: This will reset FCM tokens for ALL users!")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import reset_fcm_token_for_users
                 reset_fcm_token_for_users(reset_all=True)
             else:
                 print("❌ Reset cancelled")
@@ -321,6 +334,7 @@ def main():
             print("⚠️  WARNING: This will reset FCM token for a specific admin!")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import reset_fcm_token_for_admins
                 reset_fcm_token_for_admins(reset_all=False)
             else:
                 print("❌ Reset cancelled")
@@ -331,6 +345,7 @@ def main():
             print("⚠️  WARNING: This will reset FCM tokens for ALL admins!")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import reset_fcm_token_for_admins
                 reset_fcm_token_for_admins(reset_all=True)
             else:
                 print("❌ Reset cancelled")
@@ -341,6 +356,7 @@ def main():
             print("⚠️  DANGER: This will reset FCM tokens for ALL users AND admins!")
             confirm = input("Type 'RESET ALL' to confirm: ").strip()
             if confirm == "RESET ALL":
+                from migrations import reset_fcm_token_all
                 reset_fcm_token_all(reset_all_users=True, reset_all_admins=True)
             else:
                 print("❌ Reset cancelled")
@@ -351,6 +367,7 @@ def main():
             print("⚠️  WARNING: This will run custom migration!")
             confirm = input("Continue? (yes/no): ").strip().lower()
             if confirm == "yes":
+                from migrations import custom_migration
                 custom_migration()
             else:
                 print("❌ Custom migration cancelled")
@@ -3,12 +3,21 @@
 Database migration functions
 """
 
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud.firestore_v1.base_query import FieldFilter
 from firebase_manager import firebase_manager
 
 
-def migrate_add_fcm_field_to_users():
+def _add_fcm_field(collection_name, label):
     """
-    Migration: Add fcmToken and fcmTokenUpdatedAt fields to whitelist_users
+    Add fcmToken and fcmTokenUpdatedAt fields to every document in a collection
+    
+    Args:
+        collection_name: Firestore collection ('whitelist_users' or 'admin_users')
+        label: Plural noun used in output ('users' or 'admins')
     """
     try:
         if firebase_manager.db is None:
@@ -16,96 +25,68 @@ def migrate_add_fcm_field_to_users():
             return False
         
         print("=" * 60)
-        print("🔧 MIGRATION: Adding fcmToken field to users")
+        print(f"🔧 MIGRATION: Adding fcmToken field to {label}")
         print("=" * 60)
         
-        users_ref = firebase_manager.db.collection('whitelist_users')
-        all_users = users_ref.stream()
+        collection_ref = firebase_manager.db.collection(collection_name)
+        all_docs = firebase_manager.stream_in_pages(collection_ref.select(['email', 'fcmToken']))
         
-        updated_count = 0
+        log_lines = []
         skipped_count = 0
         
-        for doc in all_users:
-            user_data = doc.to_dict()
-            email = user_data.get('email', 'unknown')
-            
-            if 'fcmToken' in user_data:
-                print(f"   ⏭️  {email}: Already has fcmToken field (skipped)")
-                skipped_count += 1
-                continue
-            
-            doc.reference.update({
-                'fcmToken': '',
-                'fcmTokenUpdatedAt': 0
-            })
-            
-            updated_count += 1
-            print(f"   ✅ {email}: Added fcmToken field")
+        def pending_writes():
+            # Generator so commit_in_batches commits while the stream is still read
+            nonlocal skipped_count
+            for doc in all_docs:
+                doc_data = doc.to_dict()
+                email = doc_data.get('email', 'unknown')
+                
+                # Checked client-side: Firestore queries never match documents that
+                # lack a field (==, <, != and sentinel filters all skip them)
+                if 'fcmToken' in doc_data:
+                    log_lines.append(f"   ⏭️  {email}: Already has fcmToken field (skipped)")
+                    skipped_count += 1
+                    continue
+                
+                log_lines.append(f"   ✅ {email}: Added fcmToken field")
+                yield doc.reference, {
+                    'fcmToken': '',
+                    'fcmTokenUpdatedAt': 0
+                }
+        
+        # Commit in WriteBatch chunks instead of one RPC per document
+        updated_count = firebase_manager.commit_in_batches(pending_writes())
+        
+        if log_lines:
+            sys.stdout.write("\n".join(log_lines) + "\n")
         
         print(f"\n📊 Migration Summary:")
-        print(f"   Updated: {updated_count} users")
-        print(f"   Skipped: {skipped_count} users (already have field)")
-        print(f"   Total: {updated_count + skipped_count} users")
+        print(f"   Updated: {updated_count} {label}")
+        print(f"   Skipped: {skipped_count} {label} (already have field)")
+        print(f"   Total: {updated_count + skipped_count} {label}")
         print("=" * 60)
         
+        firebase_manager.invalidate_token_cache()
         return True
-        
+    
     except Exception as e:
         print(f"❌ Migration error: {e}")
-        import traceback
         traceback.print_exc()
         return False
 
 
+def migrate_add_fcm_field_to_users():
+    """
+    Migration: Add fcmToken and fcmTokenUpdatedAt fields to whitelist_users
+    """
+    return _add_fcm_field('whitelist_users', 'users')
+
+
 def migrate_add_fcm_field_to_admins():
     """
     Migration: Add fcmToken and fcmTokenUpdatedAt fields to admin_users
     """
-    try:
-        if firebase_manager.db is None:
-            print("❌ Firestore client not initialized")
-            return False
-        
-        print("=" * 60)
-        print("🔧 MIGRATION: Adding fcmToken field to admins")
-        print("=" * 60)
-        
-        admins_ref = firebase_manager.db.collection('admin_users')
-        all_admins = admins_ref.stream()
-        
-        updated_count = 0
-        skipped_count = 0
-        
-        for doc in all_admins:
-            admin_data = doc.to_dict()
-            email = admin_data.get('email', 'unknown')
-            
-            if 'fcmToken' in admin_data:
-                print(f"   ⏭️  {email}: Already has fcmToken field (skipped)")
-                skipped_count += 1
-                continue
-            
-            doc.reference.update({
-                'fcmToken': '',
-                'fcmTokenUpdatedAt': 0
-            })
-            
-            updated_count += 1
-            print(f"   ✅ {email}: Added fcmToken field")
-        
-        print(f"\n📊 Migration Summary:")
-        print(f"   Updated: {updated_count} admins")
-        print(f"   Skipped: {skipped_count} admins (already have field)")
-        print(f"   Total: {updated_count + skipped_count} admins")
-        print("=" * 60)
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Migration error: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    return _add_fcm_field('admin_users', 'admins')
 
 
 def migrate_add_fcm_field_all():
@@ -126,12 +107,16 @@ def migrate_add_fcm_field_all():
         return False
 
 
-def reset_fcm_token_for_users(reset_all=False):
+def _reset_fcm_tokens(collection_name, label, reset_all=False, role_filter=None, with_role=False):
     """
-    Reset FCM token for whitelist_users
+    Reset FCM tokens in a collection
     
     Args:
-        reset_all: If True, reset all users. If False, ask for specific email
+        collection_name: Firestore collection ('whitelist_users' or 'admin_users')
+        label: Singular noun used in output ('user' or 'admin')
+        reset_all: If True, reset all documents. If False, ask for specific email
+        role_filter: Optional role filter ('admin', 'super_admin', etc.)
+        with_role: If True, read and display the document's role
     """
     try:
         if firebase_manager.db is None:
@@ -139,76 +124,122 @@ def reset_fcm_token_for_users(reset_all=False):
             return False
         
         print("=" * 60)
-        print("🔄 RESET FCM TOKEN: Users")
+        print(f"🔄 RESET FCM TOKEN: {label.capitalize()}s")
         print("=" * 60)
         
-        users_ref = firebase_manager.db.collection('whitelist_users')
+        collection_ref = firebase_manager.db.collection(collection_name)
         
         if reset_all:
-            print("\n⚠️  WARNING: This will reset ALL user FCM tokens!")
+            role_text = f" ({role_filter.upper()})" if role_filter else ""
+            print(f"\n⚠️  WARNING: This will reset ALL {label}{role_text} FCM tokens!")
             confirm = input("Type 'yes' to confirm: ").strip().lower()
             if confirm != 'yes':
                 print("❌ Reset cancelled")
                 return False
             
-            all_users = users_ref.stream()
+            fields = ['email', 'role'] if with_role else ['email']
+            all_docs = firebase_manager.stream_in_pages(collection_ref.select(fields))
+            bulk_writer = firebase_manager.db.bulk_writer()
+            log_lines = []
+            
+            # Count and log confirmed writes only; callbacks fire on BulkWriter's
+            # worker threads. Display names are keyed by document path
             reset_count = 0
+            count_lock = threading.Lock()
+            display_names = {}
+            
+            def on_write_result(document_reference, write_result, bulk_writer):
+                nonlocal reset_count
+                with count_lock:
+                    reset_count += 1
+                    log_lines.append(f"   ✅ {display_names.pop(document_reference.path)}: FCM token reset")
+            
+            bulk_writer.on_write_result(on_write_result)
             
-            for doc in all_users:
-                user_data = doc.to_dict()
-                email = user_data.get('email', 'unknown')
+            for doc in all_docs:
+                doc_data = doc.to_dict()
+                email = doc_data.get('email', 'unknown')
                 
-                doc.reference.update({
+                if with_role:
+                    role = doc_data.get('role', 'admin')
+                    
+                    # Apply role filter if specified
+                    if role_filter and role != role_filter:
+                        continue
+                    
+                    email = f"{email} ({role})"
+                
+                with count_lock:
+                    display_names[doc.reference.path] = email
+                
+                # set(merge=True) skips update()'s exists precondition; the
+                # document was just streamed so it is known to exist
+                bulk_writer.set(doc.reference, {
                     'fcmToken': '',
                     'fcmTokenUpdatedAt': 0
-                })
-                
-                reset_count += 1
-                print(f"   ✅ {email}: FCM token reset")
+                }, merge=True)
             
-            print(f"\n📊 Reset Summary:")
-            print(f"   Total users reset: {reset_count}")
+            # BulkWriter pipelines the writes; wait for all of them to land
+            bulk_writer.flush()
+            bulk_writer.close()
             
+            if log_lines:
+                sys.stdout.write("\n".join(log_lines) + "\n")
+            
+            print(f"\n📊 Reset Summary:")
+            print(f"   Total {label}s reset: {reset_count}")
+        
         else:
-            email_to_reset = input("\nEnter user email to reset: ").strip()
+            email_to_reset = input(f"\nEnter {label} email to reset: ").strip()
             if not email_to_reset:
                 print("❌ Email cannot be empty")
                 return False
             
-            from google.cloud.firestore_v1.base_query import FieldFilter
-            
-            query = users_ref.where(
+            # Neither collection is keyed by email (whitelist_users documents are
+            # keyed by uid), so a single indexed email query is the one-RPC lookup
+            matches = collection_ref.where(
                 filter=FieldFilter('email', '==', email_to_reset)
             ).limit(1).stream()
             
             found = False
-            for doc in query:
+            for doc in matches:
                 found = True
-                user_data = doc.to_dict()
+                doc_data = doc.to_dict()
+                role_text = f" ({doc_data.get('role', 'admin')})" if with_role else ""
                 
                 doc.reference.update({
                     'fcmToken': '',
                     'fcmTokenUpdatedAt': 0
                 })
                 
-                print(f"\n✅ FCM token reset for: {email_to_reset}")
-                print(f"   Previous token: {user_data.get('fcmToken', 'N/A')[:30]}...")
+                print(f"\n✅ FCM token reset for: {email_to_reset}{role_text}")
+                print(f"   Previous token: {doc_data.get('fcmToken', 'N/A')[:30]}...")
                 print(f"   New token: (empty)")
             
             if not found:
-                print(f"\n❌ User not found: {email_to_reset}")
+                print(f"\n❌ {label.capitalize()} not found: {email_to_reset}")
                 return False
         
         print("=" * 60)
+        firebase_manager.invalidate_token_cache()
         return True
-        
+    
     except Exception as e:
         print(f"❌ Reset error: {e}")
-        import traceback
         traceback.print_exc()
         return False
 
 
+def reset_fcm_token_for_users(reset_all=False):
+    """
+    Reset FCM token for whitelist_users
+    
+    Args:
+        reset_all: If True, reset all users. If False, ask for specific email
+    """
+    return _reset_fcm_tokens('whitelist_users', 'user', reset_all=reset_all)
+
+
 def reset_fcm_token_for_admins(reset_all=False, role_filter=None):
     """
     Reset FCM token for admin_users
@@ -217,87 +248,9 @@ def reset_fcm_token_for_admins(reset_all=False, role_filter=None):
         reset_all: If True, reset all admins. If False, ask for specific email
         role_filter: Optional role filter ('admin', 'super_admin', etc.)
     """
-    try:
-        if firebase_manager.db is None:
-            print("❌ Firestore client not initialized")
-            return False
-        
-        print("=" * 60)
-        print("🔄 RESET FCM TOKEN: Admins")
-        print("=" * 60)
-        
-        admins_ref = firebase_manager.db.collection('admin_users')
-        
-        if reset_all:
-            role_text = f" ({role_filter.upper()})" if role_filter else ""
-            print(f"\n⚠️  WARNING: This will reset ALL admin{role_text} FCM tokens!")
-            confirm = input("Type 'yes' to confirm: ").strip().lower()
-            if confirm != 'yes':
-                print("❌ Reset cancelled")
-                return False
-            
-            all_admins = admins_ref.stream()
-            reset_count = 0
-            
-            for doc in all_admins:
-                admin_data = doc.to_dict()
-                email = admin_data.get('email', 'unknown')
-                role = admin_data.get('role', 'admin')
-                
-                # Apply role filter if specified
-                if role_filter and role != role_filter:
-                    continue
-                
-                doc.reference.update({
-                    'fcmToken': '',
-                    'fcmTokenUpdatedAt': 0
-                })
-                
-                reset_count += 1
-                print(f"   ✅ {email} ({role}): FCM token reset")
-            
-            print(f"\n📊 Reset Summary:")
-            print(f"   Total admins reset: {reset_count}")
-            
-        else:
-            email_to_reset = input("\nEnter admin email to reset: ").strip()
-            if not email_to_reset:
-                print("❌ Email cannot be empty")
-                return False
-            
-            from google.cloud.firestore_v1.base_query import FieldFilter
-            
-            query = admins_ref.where(
-                filter=FieldFilter('email', '==', email_to_reset)
-            ).limit(1).stream()
-            
-            found = False
-            for doc in query:
-                found = True
-                admin_data = doc.to_dict()
-                role = admin_data.get('role', 'admin')
-                
-                doc.reference.update({
-                    'fcmToken': '',
-                    'fcmTokenUpdatedAt': 0
-                })
-                
-                print(f"\n✅ FCM token reset for: {email_to_reset} ({role})")
-                print(f"   Previous token: {admin_data.get('fcmToken', 'N/A')[:30]}...")
-                print(f"   New token: (empty)")
-            
-            if not found:
-                print(f"\n❌ Admin not found: {email_to_reset}")
-                return False
-        
-        print("=" * 60)
-        return True
-        
-    except Exception as e:
-        print(f"❌ Reset error: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    return _reset_fcm_tokens(
+        'admin_users', 'admin', reset_all=reset_all, role_filter=role_filter, with_role=True
+    )
 
 
 def reset_fcm_token_all(reset_all_users=False, reset_all_admins=False, admin_role_filter=None):
@@ -338,6 +291,89 @@ def reset_fcm_token_all(reset_all_users=False, reset_all_admins=False, admin_rol
         return False
 
 
+_STATUS_SAMPLE_LIMIT = 20
+
+
+def _count(query):
+    """Run a count() aggregation and return the integer result"""
+    return query.count().get()[0][0].value
+
+
+def _fcm_token_status(collection_ref, with_role=False):
+    """
+    Count documents by fcmToken state using aggregation queries
+    
+    EMPTY covers '', null and whitespace-only tokens, matching the old
+    client-side classification.
+    
+    Args:
+        collection_ref: Firestore collection reference
+        with_role: If True, sample labels include the document's role
+    
+    Returns:
+        (without_count, empty_count, filled_count, empty_sample, filled_sample)
+        where empty_sample is a list of labels and filled_sample a list of
+        (label, token), each capped at _STATUS_SAMPLE_LIMIT
+    """
+    empty_queries = [
+        collection_ref.where(filter=FieldFilter('fcmToken', '==', '')),
+        collection_ref.where(filter=FieldFilter('fcmToken', '==', None)),
+        # Strings sorting below '!' start with whitespace/control characters,
+        # which real FCM tokens never do: whitespace-only tokens land here
+        collection_ref.where(filter=FieldFilter('fcmToken', '>', '')).where(
+            filter=FieldFilter('fcmToken', '<', '!')
+        ),
+    ]
+    filled_query = collection_ref.where(filter=FieldFilter('fcmToken', '>=', '!'))
+    fields = ['email', 'role'] if with_role else ['email']
+    
+    def label_of(doc_data):
+        label = doc_data.get('email', 'unknown')
+        if with_role:
+            label = f"{label} ({doc_data.get('role', 'admin')})"
+        return label
+    
+    # Documents missing the field can't be matched by any query, so that
+    # bucket is derived from the total
+    total = _count(collection_ref)
+    empty_count = sum(_count(query) for query in empty_queries)
+    filled_count = _count(filled_query)
+    
+    empty_sample = []
+    for query in empty_queries:
+        remaining = _STATUS_SAMPLE_LIMIT - len(empty_sample)
+        if remaining <= 0:
+            break
+        empty_sample.extend(
+            label_of(doc.to_dict())
+            for doc in query.select(fields).limit(remaining).stream()
+        )
+    
+    filled_sample = []
+    for doc in filled_query.select(fields + ['fcmToken']).limit(_STATUS_SAMPLE_LIMIT).stream():
+        doc_data = doc.to_dict()
+        filled_sample.append((label_of(doc_data), doc_data.get('fcmToken', '')))
+    
+    # Remainder: field missing, or holding a non-string, non-null value
+    without_count = total - empty_count - filled_count
+    return without_count, empty_count, filled_count, empty_sample, filled_sample
+
+
+def _print_fcm_token_status(without_count, empty_count, filled_count, empty_sample, filled_sample):
+    """Print the counts and samples produced by _fcm_token_status"""
+    print(f"\n❌ Without fcmToken field, or non-string value ({without_count}):")
+    
+    print(f"\n⚠️  With fcmToken field but EMPTY ({empty_count}):")
+    sys.stdout.write("".join(f"   • {label}\n" for label in empty_sample))
+    if empty_count > len(empty_sample):
+        print(f"   ... and {empty_count - len(empty_sample)} more")
+    
+    print(f"\n✅ With fcmToken field and FILLED ({filled_count}):")
+    sys.stdout.write("".join(f"   • {label}: {token[:20]}...{token[-10:]}\n" for label, token in filled_sample))
+    if filled_count > len(filled_sample):
+        print(f"   ... and {filled_count - len(filled_sample)} more")
+
+
 def check_fcm_token_status():
     """
     Check FCM token status for both users and admins
@@ -351,107 +387,60 @@ def check_fcm_token_status():
         print("🔍 CHECKING FCM TOKEN STATUS")
         print("=" * 60)
         
-        # Check users
-        print("\n👥 CHECKING USERS:")
-        print("-" * 60)
-        
         users_ref = firebase_manager.db.collection('whitelist_users')
-        all_users = users_ref.stream()
-        
-        users_without_field = []
-        users_with_field_empty = []
-        users_with_field_filled = []
+        admins_ref = firebase_manager.db.collection('admin_users')
         
-        for doc in all_users:
-            user_data = doc.to_dict()
-            email = user_data.get('email', 'unknown')
-            
-            if 'fcmToken' not in user_data:
-                users_without_field.append(email)
-            elif not user_data.get('fcmToken') or user_data.get('fcmToken').strip() == '':
-                users_with_field_empty.append(email)
-            else:
-                fcm_token = user_data.get('fcmToken', '')
-                users_with_field_filled.append((email, fcm_token))
+        # Aggregate both collections concurrently instead of streaming every document
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            users_future = executor.submit(_fcm_token_status, users_ref)
+            admins_future = executor.submit(_fcm_token_status, admins_ref, True)
+            users_status = users_future.result()
+            admins_status = admins_future.result()
         
-        print(f"\n❌ Without fcmToken field ({len(users_without_field)}):")
-        for email in users_without_field:
-            print(f"   • {email}")
+        users_without_field, users_with_field_empty, users_with_field_filled = users_status[:3]
+        admins_without_field, admins_with_field_empty, admins_with_field_filled = admins_status[:3]
         
-        print(f"\n⚠️  With fcmToken field but EMPTY ({len(users_with_field_empty)}):")
-        for email in users_with_field_empty:
-            print(f"   • {email}")
+        # Check users
+        print("\n👥 CHECKING USERS:")
+        print("-" * 60)
         
-        print(f"\n✅ With fcmToken field and FILLED ({len(users_with_field_filled)}):")
-        for email, token in users_with_field_filled:
-            print(f"   • {email}: {token[:20]}...{token[-10:]}")
+        _print_fcm_token_status(*users_status)
         
         # Check admins
         print("\n\n👑 CHECKING ADMINS:")
         print("-" * 60)
         
-        admins_ref = firebase_manager.db.collection('admin_users')
-        all_admins = admins_ref.stream()
-        
-        admins_without_field = []
-        admins_with_field_empty = []
-        admins_with_field_filled = []
-        
-        for doc in all_admins:
-            admin_data = doc.to_dict()
-            email = admin_data.get('email', 'unknown')
-            role = admin_data.get('role', 'admin')
-            
-            if 'fcmToken' not in admin_data:
-                admins_without_field.append((email, role))
-            elif not admin_data.get('fcmToken') or admin_data.get('fcmToken').strip() == '':
-                admins_with_field_empty.append((email, role))
-            else:
-                fcm_token = admin_data.get('fcmToken', '')
-                admins_with_field_filled.append((email, role, fcm_token))
-        
-        print(f"\n❌ Without fcmToken field ({len(admins_without_field)}):")
-        for email, role in admins_without_field:
-            print(f"   • {email} ({role})")
-        
-        print(f"\n⚠️  With fcmToken field but EMPTY ({len(admins_with_field_empty)}):")
-        for email, role in admins_with_field_empty:
-            print(f"   • {email} ({role})")
-        
-        print(f"\n✅ With fcmToken field and FILLED ({len(admins_with_field_filled)}):")
-        for email, role, token in admins_with_field_filled:
-            print(f"   • {email} ({role}): {token[:20]}...{token[-10:]}")
+        _print_fcm_token_status(*admins_status)
         
         # Summary
         print("\n" + "=" * 60)
         print("📊 SUMMARY")
         print("=" * 60)
         print(f"\nUSERS:")
-        print(f"   Without field: {len(users_without_field)}")
-        print(f"   With empty field: {len(users_with_field_empty)}")
-        print(f"   With filled field: {len(users_with_field_filled)}")
+        print(f"   Without field: {users_without_field}")
+        print(f"   With empty field: {users_with_field_empty}")
+        print(f"   With filled field: {users_with_field_filled}")
         print(f"\nADMINS:")
-        print(f"   Without field: {len(admins_without_field)}")
-        print(f"   With empty field: {len(admins_with_field_empty)}")
-        print(f"   With filled field: {len(admins_with_field_filled)}")
+        print(f"   Without field: {admins_without_field}")
+        print(f"   With empty field: {admins_with_field_empty}")
+        print(f"   With filled field: {admins_with_field_filled}")
         
         print("\n💡 ACTION REQUIRED:")
-        if len(users_without_field) > 0 or len(admins_without_field) > 0:
+        if users_without_field > 0 or admins_without_field > 0:
             print("   ⚠️  Some users/admins need fcmToken field added")
             print("   🔧 Run migration to add fcmToken field")
         
-        if len(users_with_field_empty) > 0 or len(admins_with_field_empty) > 0:
+        if users_with_field_empty > 0 or admins_with_field_empty > 0:
             print("   ⚠️  Some users/admins have empty fcmToken")
             print("   🔧 Users/admins need to login to app to save their FCM token")
         
-        if len(users_with_field_filled) > 0 or len(admins_with_field_filled) > 0:
+        if users_with_field_filled > 0 or admins_with_field_filled > 0:
             print("   ✅ Some users/admins ready to receive signals")
         
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"❌ Error checking FCM token status: {e}")
-        import traceback
         traceback.print_exc()
 
 
@@ -474,9 +463,8 @@ def custom_migration():
         print("   Edit migrations.py -> custom_migration() to add your logic")
         
         return True
-        
+    
     except Exception as e:
         print(f"❌ Custom migration error: {e}")
-        import traceback
         traceback.print_exc()
         return False
\ No newline at end of file
@@ -3,106 +3,194 @@
 Trading signal parser with smart execution timing
 """
 
+import logging
+import time
 from datetime import datetime
+from functools import lru_cache
 from config import SIGNAL_PATTERNS
 from utils import utc_to_wib
 
+log = logging.getLogger(__name__)
+
+# Signal letter (as captured by SIGNAL_PATTERNS) -> trend
+TREND_MAP = {"S": "put", "B": "call"}
+
+# _parse_core failure reasons, logged by parse_signal
+_MULTIPLE_SIGNALS = "multiple_signals"
+_NO_PATTERN = "no_pattern"
+_INVALID_TIME = "invalid_time"
+
+# Trend -> display form, so hot-path logging skips str.upper()
+TREND_UPPER = {"call": "CALL", "put": "PUT"}
+
+# Execution (hour, minute) per WIB minute-of-day: [0] next minute, [1] skip to +2
+_EXEC_TABLE = tuple(
+    (divmod((m + 1) % 1440, 60), divmod((m + 2) % 1440, 60))
+    for m in range(1440)
+)
+
+# [epoch_second, isoformat string] for parsed_at, rebuilt at most once per second
+_iso_cache = [0, '']
+
+
+def parsed_at_now() -> str:
+    """Local ISO timestamp for parsed_at, cached per second"""
+    sec = time.time_ns() // 1_000_000_000
+    if sec != _iso_cache[0]:
+        _iso_cache[:] = [sec, datetime.fromtimestamp(sec).isoformat()]
+    return _iso_cache[1]
+
 
 def parse_signal(message_text: str, message_time: datetime = None) -> dict:
     """Parse trading signal from Telegram message"""
     text = message_text.strip().upper()
     
-    print(f"🔍 Parsing signal:")
-    print(f"   Input: '{text}'")
-    
-    # Get current WIB time for seconds
-    current_wib = None
-    if message_time:
-        current_wib = utc_to_wib(message_time)
+    log.info("🔍 Parsing signal:")
+    log.info("   Input: '%s'", text)
     
-    # Check if message contains multiple signals
-    all_matches = SIGNAL_PATTERNS["time_with_trend"].findall(text)
-    
-    if len(all_matches) > 1:
-        print("⚠️  Multiple signals detected - IGNORING")
+    # Fast reject: a timed signal needs a ':' or '.' separator and a bare
+    # trend is exactly one signal letter; anything else skips the regex
+    if ':' not in text and '.' not in text and text not in TREND_MAP:
+        log.info("❌ No valid signal pattern found")
         return None
     
-    # Pattern 1: Time specified
-    match = SIGNAL_PATTERNS["time_with_trend"].search(text)
+    parsed = _scan_timed_signal(text)
+    if parsed is None:
+        reason, parsed = _parse_core(text)
+        if reason is _MULTIPLE_SIGNALS:
+            log.info("⚠️  Multiple signals detected - IGNORING")
+            return None
+        if reason is _INVALID_TIME:
+            log.info("⚠️  Invalid time: %s:%s", parsed[1], parsed[2])
+            return None
+        if reason is _NO_PATTERN:
+            log.info("❌ No valid signal pattern found")
+            return None
     
-    if not match:
-        match = SIGNAL_PATTERNS["time_with_trend_strict"].search(text)
+    trend, hour, minute = parsed
     
-    if match:
-        hour = int(match.group(1))
-        minute = int(match.group(2))
-        signal = match.group(3)
-        
-        if not (0 <= hour <= 23 and 0 <= minute <= 59):
-            print(f"⚠️  Invalid time: {hour}:{minute}")
-            return None
-        
-        trend = "put" if signal == "S" else "call"
-        
+    # Get current WIB time for seconds (naive input is treated as UTC)
+    current_wib = utc_to_wib(message_time) if message_time else None
+    
+    # Pattern 1: Time specified
+    if hour is not None:
         # Get seconds from message time
         second = current_wib.second if current_wib else 0
+        auto_time_added = False
         
-        print(f"✅ Parsed: {hour:02d}:{minute:02d}:{second:02d} {trend.upper()}")
-        
-        return {
-            "trend": trend,
-            "has_time": True,
-            "hour": hour,
-            "minute": minute,
-            "second": second,
-            "original_message": message_text,
-            "auto_time_added": False,
-            "parsed_at": datetime.now().isoformat()
-        }
+        log.info("✅ Parsed: %02d:%02d:%02d %s", hour, minute, second, TREND_UPPER[trend])
     
     # Pattern 2: Simple trend only with smart execution timing
-    match = SIGNAL_PATTERNS["simple_trend"].match(text)
-    if match:
-        signal = match.group(1)
-        trend = "put" if signal == "S" else "call"
+    elif current_wib:
+        wib_hour, wib_minute, wib_second = current_wib.hour, current_wib.minute, current_wib.second
+        
+        # Calculate seconds until next minute boundary
+        seconds_in_current_minute = wib_second
+        seconds_until_next_minute = 60 - seconds_in_current_minute
+        
+        # Determine execution time based on 30-second threshold
+        skip = seconds_until_next_minute < 30
+        execution_hour, execution_minute = _EXEC_TABLE[wib_hour * 60 + wib_minute][skip]
+        execution_second = 0  # Start at 0 seconds
+        if not skip:
+            # Execute at next minute (e.g., 15:20:28 -> 15:21:00)
+            log.info("🕐 Signal received at :%ss → %ss remaining → Execute NEXT minute",
+                     seconds_in_current_minute, seconds_until_next_minute)
+        else:
+            # Execute 2 minutes later (e.g., 15:20:32 -> 15:22:00)
+            log.info("🕐 Signal received at :%ss → %ss remaining → Execute SKIP to +2 minutes",
+                     seconds_in_current_minute, seconds_until_next_minute)
+        
+        hour = execution_hour
+        minute = execution_minute
+        second = execution_second
+        auto_time_added = True
         
-        if current_wib:
-            # Calculate seconds until next minute boundary
-            seconds_in_current_minute = current_wib.second
-            seconds_until_next_minute = 60 - seconds_in_current_minute
-            
-            # Determine execution time based on 30-second threshold
-            if seconds_until_next_minute >= 30:
-                # Execute at next minute (e.g., 15:20:28 -> 15:21:00)
-                execution_minute = (current_wib.minute + 1) % 60
-                execution_hour = current_wib.hour + (1 if current_wib.minute == 59 else 0)
-                execution_hour = execution_hour % 24
-                execution_second = 0  # Start at 0 seconds
-                print(f"🕐 Signal received at :{seconds_in_current_minute}s → {seconds_until_next_minute}s remaining → Execute NEXT minute")
-            else:
-                # Execute 2 minutes later (e.g., 15:20:32 -> 15:22:00)
-                execution_minute = (current_wib.minute + 2) % 60
-                execution_hour = current_wib.hour + ((current_wib.minute + 2) // 60)
-                execution_hour = execution_hour % 24
-                execution_second = 0  # Start at 0 seconds
-                print(f"🕐 Signal received at :{seconds_in_current_minute}s → {seconds_until_next_minute}s remaining → Execute SKIP to +2 minutes")
-            
-            hour = execution_hour
-            minute = execution_minute
-            second = execution_second
-            
-            print(f"✅ Auto-time: {hour:02d}:{minute:02d}:{second:02d} WIB (from {current_wib.strftime('%H:%M:%S')})")
-            
-            return {
-                "trend": trend,
-                "has_time": True,
-                "hour": hour,
-                "minute": minute,
-                "second": second,
-                "original_message": message_text,
-                "auto_time_added": True,
-                "parsed_at": datetime.now().isoformat()
-            }
-    
-    print(f"❌ No valid signal pattern found")
-    return None
\ No newline at end of file
+        log.info("✅ Auto-time: %02d:%02d:%02d WIB (from %02d:%02d:%02d)",
+                 hour, minute, second, wib_hour, wib_minute, wib_second)
+    
+    else:
+        log.info("❌ No valid signal pattern found")
+        return None
+    
+    return {
+        "trend": trend,
+        "has_time": True,
+        "hour": hour,
+        "minute": minute,
+        "second": second,
+        "original_message": message_text,
+        "auto_time_added": auto_time_added,
+        "parsed_at": parsed_at_now()
+    }
+
+
+def _scan_timed_signal(text: str) -> tuple:
+    """
+    Fast path for the common exact shapes "H:MM S" and "HH:MM S"
+    
+    Returns (trend, hour, minute) like _parse_core, or None when the text
+    is any other shape (or out of range) and must go through the regex.
+    """
+    n = len(text)
+    if n == 7:
+        h1, h0 = text[0], text[1]
+        if not ('0' <= h1 <= '9'):
+            return None
+        hour_tens = ord(h1) - 48
+    elif n == 6:
+        h0 = text[0]
+        hour_tens = 0
+    else:
+        return None
+    
+    sep, m1, m0, space, letter = text[n - 5:]
+    if (
+        not ('0' <= h0 <= '9' and '0' <= m1 <= '5' and '0' <= m0 <= '9')
+        or sep not in ':.' or space != ' ' or letter not in TREND_MAP
+    ):
+        return None
+    
+    hour = hour_tens * 10 + ord(h0) - 48
+    if hour > 23:
+        return None
+    
+    return TREND_MAP[letter], hour, (ord(m1) - 48) * 10 + ord(m0) - 48
+
+
+@lru_cache(maxsize=1024)
+def _parse_core(text: str) -> tuple:
+    """
+    Run the signal pattern over normalized text
+    
+    Independent of message time, so repeated texts are served from the
+    cache; logs nothing so a cache hit loses no output. Returns
+    (reason, (trend, hour, minute)) where reason is None on success (hour
+    and minute None for a bare trend) or one of _MULTIPLE_SIGNALS,
+    _NO_PATTERN and _INVALID_TIME (which keeps the parsed hour/minute).
+    """
+    # Single pass over the combined pattern: count matches and keep the first.
+    # The bare-trend alternative only matches a one-letter text, where the
+    # timed alternative cannot, so the two never both match.
+    matches = list(SIGNAL_PATTERNS["combined"].finditer(text))
+    
+    if len(matches) > 1:
+        return _MULTIPLE_SIGNALS, None
+    
+    if not matches:
+        return _NO_PATTERN, None
+    
+    match = matches[0]
+    
+    # Bare trend: execution time is derived from the message time by the caller
+    if match.group(4) is not None:
+        return None, (TREND_MAP[match.group(4)], None, None)
+    
+    # Timed signal
+    hour = int(match.group(1))
+    minute = int(match.group(2))
+    
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return _INVALID_TIME, (None, hour, minute)
+    
+    return None, (TREND_MAP[match.group(3)], hour, minute)
\ No newline at end of file
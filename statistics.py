@@ -3,19 +3,54 @@
 Statistics tracking for signal broadcasting
 """
 
-from datetime import datetime
+import hashlib
+import math
+import threading
+import time
+from config import SUMMARY_PRINT_INTERVAL
 
 
-class Statistics:
+class _BloomFilter:
+    """Fixed-size Bloom filter for approximate set membership"""
+    
+    def __init__(self, capacity: int = 100_000, error_rate: float = 1e-3):
+        self.num_bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+    
+    def add(self, key: str) -> bool:
+        """Add key; returns True if it was (probably) not present before"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        
+        new = False
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        return new
+
+
+class StatsShard:
+    """
+    Per-send counters merged into the global Statistics in one step
+    
+    Each sender thread logs into its own shard without touching shared
+    state, then calls Statistics.merge() once when the send finishes.
+    """
+    
     def __init__(self):
         self.total_signals = 0
         self.successful_sends = 0
         self.failed_sends = 0
-        self.signals_by_trend = {"call": 0, "put": 0}
-        self.start_time = datetime.now()
-        self.devices_reached = set()
+        self.calls = 0
+        self.puts = 0
         self.user_sends = 0
         self.admin_sends = 0
+        self.devices = []
     
     def log_signal(self, trend: str, success: bool, identifier: str = None, user_type: str = "user"):
         """Log a signal send attempt"""
@@ -23,39 +58,100 @@ class Statistics:
         if success:
             self.successful_sends += 1
             if identifier:
-                self.devices_reached.add(identifier)
-            if "admin" in user_type.lower():
+                self.devices.append(identifier)
+            if user_type.startswith("admin"):
                 self.admin_sends += 1
             else:
                 self.user_sends += 1
         else:
             self.failed_sends += 1
         
-        if trend in self.signals_by_trend:
-            self.signals_by_trend[trend] += 1
+        if trend == "call":
+            self.calls += 1
+        elif trend == "put":
+            self.puts += 1
+
+
+class Statistics:
+    def __init__(self):
+        self.total_signals = 0
+        self.successful_sends = 0
+        self.failed_sends = 0
+        self.calls = 0
+        self.puts = 0
+        self._start_mono = time.monotonic()
+        # Bounded memory for long runs; unique_devices is an estimate
+        self.devices_reached = _BloomFilter()
+        self._unique_estimate = 0
+        self.user_sends = 0
+        self.admin_sends = 0
+        self._summary = None  # Cached by get_summary(), cleared by merge()
+        self._since_last_print = 0
+        self._lock = threading.Lock()
+        # Cumulative time per bridge phase, from time.perf_counter_ns()
+        self.parse_time_ns = 0
+        self.token_fetch_time_ns = 0
+        self.fcm_send_time_ns = 0
+    
+    def merge(self, shard: StatsShard):
+        """Fold a StatsShard's counters into these statistics"""
+        with self._lock:
+            self._summary = None
+            self.total_signals += shard.total_signals
+            self.successful_sends += shard.successful_sends
+            self.failed_sends += shard.failed_sends
+            self.calls += shard.calls
+            self.puts += shard.puts
+            self.user_sends += shard.user_sends
+            self.admin_sends += shard.admin_sends
+            for identifier in shard.devices:
+                if self.devices_reached.add(identifier):
+                    self._unique_estimate += 1
     
     def get_summary(self) -> dict:
         """Get statistics summary"""
-        uptime = datetime.now() - self.start_time
-        return {
-            "uptime_seconds": int(uptime.total_seconds()),
-            "total_signals": self.total_signals,
-            "successful": self.successful_sends,
-            "failed": self.failed_sends,
-            "success_rate": f"{(self.successful_sends / max(self.total_signals, 1) * 100):.1f}%",
-            "calls": self.signals_by_trend["call"],
-            "puts": self.signals_by_trend["put"],
-            "unique_devices": len(self.devices_reached),
-            "user_sends": self.user_sends,
-            "admin_sends": self.admin_sends
-        }
+        # Under the lock so a concurrent merge() can't leave a stale cache behind
+        with self._lock:
+            summary = self._summary
+            if summary is None:
+                summary = self._summary = {
+                    "uptime_seconds": 0,
+                    "total_signals": self.total_signals,
+                    "successful": self.successful_sends,
+                    "failed": self.failed_sends,
+                    "success_rate": f"{(self.successful_sends / max(self.total_signals, 1) * 100):.1f}%",
+                    "calls": self.calls,
+                    "puts": self.puts,
+                    "unique_devices": self._unique_estimate,
+                    "user_sends": self.user_sends,
+                    "admin_sends": self.admin_sends
+                }
+            
+            # Uptime and phase timings change between merge() calls
+            summary["uptime_seconds"] = int(time.monotonic() - self._start_mono)
+            summary["parse_time_ms"] = self.parse_time_ns // 1_000_000
+            summary["token_fetch_time_ms"] = self.token_fetch_time_ns // 1_000_000
+            summary["fcm_send_time_ms"] = self.fcm_send_time_ns // 1_000_000
+            return dict(summary)
+    
+    def should_print_summary(self) -> bool:
+        """Count a handled signal; True once every SUMMARY_PRINT_INTERVAL signals"""
+        self._since_last_print += 1
+        if self._since_last_print >= SUMMARY_PRINT_INTERVAL:
+            self._since_last_print = 0
+            return True
+        return False
+    
+    def format_summary(self) -> str:
+        """Format statistics summary for display"""
+        summary = self.get_summary()
+        return "\n📊 Statistics Summary:\n" + "\n".join(
+            f"   {key}: {value}" for key, value in summary.items()
+        )
     
     def print_summary(self):
         """Print statistics summary"""
-        summary = self.get_summary()
-        print("\n📊 Statistics Summary:")
-        for key, value in summary.items():
-            print(f"   {key}: {value}")
+        print(self.format_summary())
     
     def reset(self):
         """Reset all statistics"""
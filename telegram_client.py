@@ -4,6 +4,10 @@ Telegram client for monitoring signals
 """
 
 import asyncio
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 from telethon import TelegramClient, events
 from telethon.errors import (
     FloodWaitError, 
@@ -12,13 +16,113 @@ from telethon.errors import (
     ServerError,
     RPCError
 )
-from config import TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_SESSION, TELEGRAM_CHANNEL_ID
-from utils import get_current_time, utc_to_wib, print_separator
-from signal_parser import parse_signal
-from fcm_sender import send_signal_to_tokens
+from config import (
+    TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_SESSION, TELEGRAM_CHANNEL_ID,
+    SIGNAL_FLUSH_INTERVAL_SECONDS, SIGNAL_QUEUE_SIZE, SENDER_WORKERS
+)
+from utils import get_current_time, utc_to_wib, configure_logging, SEP_DASH, SEP_EQ
+from signal_parser import parse_signal, TREND_UPPER
+from fcm_sender import send_signal_to_tokens_async
 from firebase_manager import firebase_manager
 from statistics import stats
 
+# Bridge output (this module, parser, sender, token fetch) goes through a queue
+# so the event loop never blocks on stdout; a listener thread drives the
+# root handlers set up by configure_logging()
+log = logging.getLogger(__name__)
+_log_listener = None
+_saved_root_handlers = None
+
+
+def _start_log_listener():
+    """Move the root handlers behind a queue and start the writer thread (idempotent)"""
+    global _log_listener, _saved_root_handlers
+    if _log_listener is not None:
+        return
+    
+    configure_logging()
+    root = logging.getLogger()
+    _saved_root_handlers = root.handlers[:]
+    
+    log_queue = queue.Queue(-1)
+    root.handlers = [QueueHandler(log_queue)]
+    
+    _log_listener = QueueListener(log_queue, *_saved_root_handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    """Flush queued log records, stop the writer thread and restore the root handlers"""
+    global _log_listener, _saved_root_handlers
+    if _log_listener is not None:
+        logging.getLogger().handlers = _saved_root_handlers
+        _log_listener.stop()
+        _log_listener = None
+        _saved_root_handlers = None
+
+
+# Channel entity resolved on first connect, reused on reconnects
+_cached_entity = None
+
+# Parsed signals waiting for the next flush
+_pending_signals = []
+
+
+async def _flush_pending_signals(signal_queue, user_only=False, admin_only=False, admin_role_filter=None):
+    """
+    Periodically hand buffered signals to the sender workers
+    
+    A burst of signals arriving within one flush interval shares a single
+    token fetch instead of querying Firestore once per signal.
+    """
+    while True:
+        await asyncio.sleep(SIGNAL_FLUSH_INTERVAL_SECONDS)
+        if not _pending_signals:
+            continue
+        
+        signals = _pending_signals[:]
+        _pending_signals.clear()
+        
+        try:
+            # Get tokens based on mode (off the event loop)
+            t0 = time.perf_counter_ns()
+            tokens = await asyncio.to_thread(
+                firebase_manager.get_all_fcm_tokens_combined,
+                user_only=user_only,
+                admin_only=admin_only,
+                admin_role_filter=admin_role_filter
+            )
+            stats.token_fetch_time_ns += time.perf_counter_ns() - t0
+            
+            for signal in signals:
+                try:
+                    signal_queue.put_nowait((signal, tokens))
+                except asyncio.QueueFull:
+                    log.info("⚠️ Send queue full, dropping signal: %s", signal['original_message'])
+        
+        except Exception as e:
+            log.exception("❌ Error fetching tokens for buffered signals: %s", e)
+
+
+async def _sender_worker(signal_queue):
+    """Send queued signals so FCM latency never stalls message handling"""
+    while True:
+        signal, tokens = await signal_queue.get()
+        try:
+            # Send to tokens
+            t0 = time.perf_counter_ns()
+            result = await send_signal_to_tokens_async(signal, tokens)
+            stats.fcm_send_time_ns += time.perf_counter_ns() - t0
+            
+            if stats.should_print_summary():
+                log.info("📊 Current Statistics: %s", stats.get_summary())
+        
+        except Exception as e:
+            log.exception("❌ Error sending signal: %s", e)
+        
+        finally:
+            signal_queue.task_done()
+
 
 async def listen_telegram_signals(user_only=False, admin_only=False, admin_role_filter=None):
     """
@@ -29,6 +133,9 @@ async def listen_telegram_signals(user_only=False, admin_only=False, admin_role_
         admin_only: If True, send only to admins
         admin_role_filter: Filter admins by role (e.g., 'super_admin')
     """
+    global _cached_entity
+    
+    _start_log_listener()
     
     mode_text = "ALL USERS + ADMINS"
     if user_only:
@@ -42,157 +149,172 @@ async def listen_telegram_signals(user_only=False, admin_only=False, admin_role_
     max_retries = 10  # Increased for production stability
     retry_delay = 5  # seconds
     retry_count = 0
-    client = None
+    started = False
     
-    while True:
+    # One client for the whole run: reconnects reuse its session and handlers
+    client = TelegramClient(TELEGRAM_SESSION, TELEGRAM_API_ID, TELEGRAM_API_HASH)
+    
+    # Set connection timeout
+    client.flood_sleep_threshold = 60
+    
+    @client.on(events.NewMessage(chats=TELEGRAM_CHANNEL_ID))
+    async def handle_new_message(event):
         try:
-            print("=" * 60)
-            print(f"🚀 TELEGRAM TO FCM BRIDGE - {mode_text}")
-            if retry_count > 0:
-                print(f"🔄 Reconnection attempt {retry_count}/{max_retries}")
-            print("=" * 60)
+            msg = event.message
+            
+            utc_time = msg.date
+            wib_time = utc_to_wib(utc_time)
+            
+            log.info("\n" + SEP_DASH)
+            log.info("📩 New message received")
+            log.info("⏰ WIB: %s", wib_time.strftime('%Y-%m-%d %H:%M:%S'))
+            log.info("📝 Content: %s", msg.text if msg.text else '[No text]')
             
-            now_utc, now_wib = get_current_time()
-            print(f"⏰ Current UTC: {now_utc.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            print(f"🇮🇩 Current WIB: {now_wib.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-            print(f"📡 Method: Token-based (Firestore)")
-            print(f"👥 Target: {mode_text}")
-            print()
+            if not msg.text:
+                log.info("⚠️ Message has no text, skipping")
+                return
             
-            # Create new client instance
-            client = TelegramClient(TELEGRAM_SESSION, TELEGRAM_API_ID, TELEGRAM_API_HASH)
+            # Parse signal
+            t0 = time.perf_counter_ns()
+            signal = parse_signal(msg.text, message_time=msg.date)
+            stats.parse_time_ns += time.perf_counter_ns() - t0
             
-            # Set connection timeout
-            client.flood_sleep_threshold = 60
+            if signal:
+                log.info("✅ Valid signal detected!")
+                log.info("   Trend: %s", TREND_UPPER[signal['trend']])
+                log.info("   Execute at: %02d:%02d WIB", signal['hour'], signal['minute'])
+                
+                # Queue for the flush task, which fetches tokens and sends
+                _pending_signals.append(signal)
+            else:
+                log.info("ℹ️ Not a trading signal, ignoring")
             
-            await client.start()
-            print("✅ Telegram client connected")
-            retry_count = 0  # Reset retry count on successful connection
-            retry_delay = 5  # Reset retry delay
+            log.info(SEP_DASH)
             
+        except Exception as e:
+            log.exception("❌ Error handling message: %s", e)
+    
+    signal_queue = asyncio.Queue(maxsize=SIGNAL_QUEUE_SIZE)
+    background_tasks = [
+        asyncio.create_task(
+            _flush_pending_signals(signal_queue, user_only, admin_only, admin_role_filter)
+        )
+    ]
+    background_tasks.extend(
+        asyncio.create_task(_sender_worker(signal_queue))
+        for _ in range(SENDER_WORKERS)
+    )
+    
+    try:
+        while True:
             try:
-                entity = await client.get_entity(TELEGRAM_CHANNEL_ID)
-                print(f"📢 Monitoring channel: {entity.title}")
-                print(f"🆔 Channel ID: {entity.id}")
-                print("=" * 60)
-                print("🎧 Listening for signals... (Press Ctrl+C to stop)")
-                print()
+                log.info(SEP_EQ)
+                log.info("🚀 TELEGRAM TO FCM BRIDGE - %s", mode_text)
+                if retry_count > 0:
+                    log.info("🔄 Reconnection attempt %d/%d", retry_count, max_retries)
+                log.info(SEP_EQ)
                 
-                @client.on(events.NewMessage(chats=TELEGRAM_CHANNEL_ID))
-                async def handle_new_message(event):
-                    try:
-                        msg = event.message
-                        
-                        utc_time = msg.date
-                        wib_time = utc_to_wib(utc_time)
-                        
-                        print("\n" + "-" * 60)
-                        print(f"📩 New message received")
-                        print(f"⏰ WIB: {wib_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                        print(f"📝 Content: {msg.text if msg.text else '[No text]'}")
-                        
-                        if not msg.text:
-                            print("⚠️ Message has no text, skipping")
-                            return
-                        
-                        # Parse signal
-                        signal = parse_signal(msg.text, message_time=msg.date)
-                        
-                        if signal:
-                            print("✅ Valid signal detected!")
-                            print(f"   Trend: {signal['trend'].upper()}")
-                            print(f"   Execute at: {signal['hour']:02d}:{signal['minute']:02d} WIB")
-                            
-                            # Get tokens based on mode
-                            tokens = firebase_manager.get_all_fcm_tokens_combined(
-                                user_only=user_only,
-                                admin_only=admin_only,
-                                admin_role_filter=admin_role_filter
-                            )
-                            
-                            # Send to tokens
-                            result = send_signal_to_tokens(signal, tokens)
-                            
-                            print(f"📊 Current Statistics: {stats.get_summary()}")
-                        else:
-                            print("ℹ️ Not a trading signal, ignoring")
-                        
-                        print_separator()
-                        
-                    except Exception as e:
-                        print(f"❌ Error handling message: {e}")
-                        import traceback
-                        traceback.print_exc()
+                now_utc, now_wib = get_current_time()
+                log.info("⏰ Current UTC: %s", now_utc.strftime('%Y-%m-%d %H:%M:%S %Z'))
+                log.info("🇮🇩 Current WIB: %s", now_wib.strftime('%Y-%m-%d %H:%M:%S %Z'))
+                log.info("📡 Method: Token-based (Firestore)")
+                log.info("👥 Target: %s", mode_text)
+                log.info("")
                 
-                # Keep connection alive
-                await client.run_until_disconnected()
+                # First pass runs the interactive login if needed; reconnects
+                # reuse the authorized session and handler registration
+                if not started:
+                    await client.start()
+                    started = True
+                else:
+                    await client.connect()
+                log.info("✅ Telegram client connected")
+                retry_count = 0  # Reset retry count on successful connection
+                retry_delay = 5  # Reset retry delay
                 
+                try:
+                    if _cached_entity is None:
+                        _cached_entity = await client.get_entity(TELEGRAM_CHANNEL_ID)
+                    entity = _cached_entity
+                    log.info("📢 Monitoring channel: %s", entity.title)
+                    log.info("🆔 Channel ID: %s", entity.id)
+                    log.info(SEP_EQ)
+                    log.info("🎧 Listening for signals... (Press Ctrl+C to stop)")
+                    log.info("")
+                    
+                    # Keep connection alive
+                    await client.run_until_disconnected()
+                    
+                except KeyboardInterrupt:
+                    raise  # Re-raise to outer handler
+                    
+                except FloodWaitError as e:
+                    log.info("⚠️ Flood wait error: Need to wait %s seconds", e.seconds)
+                    await asyncio.sleep(e.seconds)
+                    raise  # Trigger reconnection after wait
+                    
+                except TimedOutError as e:
+                    log.info("⚠️ Timeout error: %s", e)
+                    raise  # Trigger reconnection
+                    
+                except ServerError as e:
+                    log.info("⚠️ Server error: %s", e)
+                    raise  # Trigger reconnection
+                    
+                except AuthKeyUnregisteredError:
+                    log.info("❌ Auth key unregistered. Please delete session file and restart.")
+                    break  # Exit completely
+                    
+                except OSError as e:
+                    log.info("⚠️ Network/OS error: %s", e)
+                    raise  # Trigger reconnection
+                    
+                except Exception as e:
+                    log.exception("❌ Unexpected error in main loop: %s", e)
+                    raise  # Trigger reconnection
+                    
             except KeyboardInterrupt:
-                raise  # Re-raise to outer handler
+                log.info("\n\n🛑 Stopping bridge...")
+                log.info(stats.format_summary())
                 
-            except FloodWaitError as e:
-                print(f"⚠️ Flood wait error: Need to wait {e.seconds} seconds")
-                await asyncio.sleep(e.seconds)
-                raise  # Trigger reconnection after wait
+                # Clean disconnect
+                if client and client.is_connected():
+                    try:
+                        await client.disconnect()
+                        log.info("👋 Telegram client disconnected")
+                    except:
+                        pass
                 
-            except TimedOutError as e:
-                print(f"⚠️ Timeout error: {e}")
-                raise  # Trigger reconnection
+                break  # Exit the retry loop completely
                 
-            except ServerError as e:
-                print(f"⚠️ Server error: {e}")
-                raise  # Trigger reconnection
+            except Exception as e:
+                retry_count += 1
+                log.info("\n❌ Connection error: %s", e)
                 
-            except AuthKeyUnregisteredError:
-                print("❌ Auth key unregistered. Please delete session file and restart.")
-                break  # Exit completely
+                # Clean disconnect before retry
+                if client:
+                    try:
+                        if client.is_connected():
+                            await client.disconnect()
+                            log.info("🔌 Disconnected previous session")
+                    except Exception as disc_error:
+                        log.info("⚠️ Error during disconnect: %s", disc_error)
                 
-            except OSError as e:
-                print(f"⚠️ Network/OS error: {e}")
-                raise  # Trigger reconnection
+                if retry_count >= max_retries:
+                    log.info("❌ Max retries (%d) reached. Exiting...", max_retries)
+                    log.info(stats.format_summary())
+                    break
                 
-            except Exception as e:
-                print(f"❌ Unexpected error in main loop: {e}")
-                import traceback
-                traceback.print_exc()
-                raise  # Trigger reconnection
+                log.info("\n🔄 Reconnecting in %s seconds...", retry_delay)
+                log.info("   Attempt %d/%d", retry_count, max_retries)
                 
-        except KeyboardInterrupt:
-            print("\n\n🛑 Stopping bridge...")
-            stats.print_summary()
-            
-            # Clean disconnect
-            if client and client.is_connected():
-                try:
-                    await client.disconnect()
-                    print("👋 Telegram client disconnected")
-                except:
-                    pass
-            
-            break  # Exit the retry loop completely
-            
-        except Exception as e:
-            retry_count += 1
-            print(f"\n❌ Connection error: {e}")
-            
-            # Clean disconnect before retry
-            if client:
-                try:
-                    if client.is_connected():
-                        await client.disconnect()
-                        print("🔌 Disconnected previous session")
-                except Exception as disc_error:
-                    print(f"⚠️ Error during disconnect: {disc_error}")
-            
-            if retry_count >= max_retries:
-                print(f"❌ Max retries ({max_retries}) reached. Exiting...")
-                stats.print_summary()
-                break
-            
-            print(f"\n🔄 Reconnecting in {retry_delay} seconds...")
-            print(f"   Attempt {retry_count}/{max_retries}")
-            
-            await asyncio.sleep(retry_delay)
-            
-            # Exponential backoff with max cap
-            retry_delay = min(retry_delay * 1.5, 60)  # Max 60 seconds
\ No newline at end of file
+                await asyncio.sleep(retry_delay)
+                
+                # Exponential backoff with max cap
+                retry_delay = min(retry_delay * 1.5, 60)  # Max 60 seconds
+    
+    finally:
+        # Runs on Ctrl+C / CancelledError too, so queued output is flushed
+        for task in background_tasks:
+            task.cancel()
+        _stop_log_listener()
\ No newline at end of file
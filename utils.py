@@ -3,21 +3,32 @@
 Utility functions for timezone and datetime operations
 """
 
-from datetime import datetime, timezone
+import logging
+import sys
+from datetime import datetime, timedelta, timezone
 from config import WIB_TZ
 
+# Separator lines used on every message, built once
+SEP_DASH = "-" * 60
+SEP_EQ = "=" * 60
+_SEPARATORS = {("-", 60): SEP_DASH, ("=", 60): SEP_EQ}
+
+# WIB is a fixed UTC+7 offset with no DST, so conversion is plain addition
+_WIB_OFFSET = timedelta(hours=7)
+_NO_OFFSET = timedelta(0)
+
 
 def utc_to_wib(utc_dt):
     """Convert UTC datetime to WIB (UTC+7)"""
-    if utc_dt.tzinfo is None:
-        utc_dt = utc_dt.replace(tzinfo=timezone.utc)
-    return utc_dt.astimezone(WIB_TZ)
+    # Naive input is treated as UTC
+    offset = utc_dt.utcoffset() or _NO_OFFSET
+    return (utc_dt + (_WIB_OFFSET - offset)).replace(tzinfo=WIB_TZ)
 
 
 def get_current_time():
     """Get current time in both UTC and WIB"""
     now_utc = datetime.now(timezone.utc)
-    now_wib = now_utc.astimezone(WIB_TZ)
+    now_wib = (now_utc + _WIB_OFFSET).replace(tzinfo=WIB_TZ)
     return now_utc, now_wib
 
 
@@ -27,9 +38,16 @@ def format_time_wib(dt):
     return wib_time.strftime('%Y-%m-%d %H:%M:%S WIB')
 
 
+def configure_logging():
+    """Send module loggers to stdout as bare messages (no-op if already configured)"""
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+    # telethon stays at its default WARNING level
+    logging.getLogger('telethon').setLevel(logging.WARNING)
+
+
 def print_separator(char="-", length=60):
     """Print a separator line"""
-    print(char * length)
+    print(_SEPARATORS.get((char, length)) or char * length)
 
 
 def print_header(text, char="="):